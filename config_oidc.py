@@ -1,9 +1,14 @@
+import hashlib, json, os, time, threading, queue, logging
+from contextlib import contextmanager
 import snowflake.connector
 import boto3
-from requests import request
+import requests
+from requests.adapters import HTTPAdapter
 from botocore.auth import SigV4Auth
 from botocore.awsrequest import AWSRequest
 
+logger = logging.getLogger(__name__)
+
 SF_URL = '<snowflake_url>'
 SF_ACCOUNT = '<snowflake_account>'
 SF_USER = '<snowflake_user>'
@@ -20,6 +25,20 @@ JWT_REQUEST_HEADERS = {
     'Content-Type': 'application/x-www-form-urlencoded'
 }
 
+TOKEN_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '_token_cache.json')
+TOKEN_DEFAULT_TTL = 3600 # Used when the auth endpoint doesn't return expires_in
+TOKEN_EXPIRY_BUFFER = 300 # Refresh the token 5 minutes before it actually expires
+TOKEN_RETRY_DELAY = 60 # Wait before retrying a failed background refresh
+AUTH_REQUEST_TIMEOUT = 10 # Seconds, the token lock is held during the request so it must not hang
+
+SF_POOL_SIZE = 4 # Maximum number of Snowflake connections open at the same time
+
+_token_cache = {}
+_boto_session = boto3.Session() # Resolves the AWS credential chain once, the resulting credentials refresh themselves when temporary
+_auth_session = requests.Session() # Keeps the TLS connection to the auth endpoint alive between refreshes
+_auth_session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=4))
+_token_lock = threading.Lock()
+
 def request_jwt(session):
     """
     Requests an OAuth token for authenticating the Snowflake connection using AWS Signature V4.
@@ -50,15 +69,106 @@ def request_jwt(session):
     frozen_credentials = credentials.get_frozen_credentials()
     SigV4Auth(frozen_credentials, 'execute-api', AUTH_API_REGION).add_auth(auth_request)
 
-    return request(
-        method='POST',
-        url=AUTH_URL,
+    return _auth_session.post(
+        AUTH_URL,
         headers=dict(auth_request.headers),
-        data=data
+        data=data,
+        timeout=AUTH_REQUEST_TIMEOUT
     )
 
-auth_response = request_jwt(boto3.Session())
-token = auth_response.json().get('access_token')
+def _token_cache_key(session):
+    """
+    Build the cache key for the full OAuth configuration and the AWS principal requesting the token.
+    The key is hashed so no configuration values or credentials end up in plain text on disk.
+    """
+    access_key = session.get_credentials().get_frozen_credentials().access_key
+    key_parts = [AUTH_URL, ' '.join(JWT_REQUEST_SCOPE), JWT_REQUEST_AUDIENCE, SF_ROLE, access_key]
+    return hashlib.sha256('|'.join(key_parts).encode()).hexdigest()
+
+def _read_token_cache():
+    try:
+        with open(TOKEN_CACHE_PATH) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+def _write_token_cache(cache):
+    try:
+        fd = os.open(TOKEN_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600) # Token is a credential, keep it private to the app user
+        with os.fdopen(fd, 'w') as cache_file:
+            json.dump(cache, cache_file)
+    except OSError:
+        pass # Caching is best effort, a failed write only costs a token request on the next start
+
+def get_token(session):
+    """
+    Return a valid OAuth access token for Snowflake, requesting a new one only when the cached token is missing or about to expire.
+
+    Tokens are cached in memory and in `TOKEN_CACHE_PATH` so process restarts can reuse them until `expires_in` minus `TOKEN_EXPIRY_BUFFER`.
+
+    Args:
+    session (boto3.Session): The AWS session used to retrieve temporary credentials.
+
+    Returns:
+    str: The OAuth access token.
+    """
+    key = _token_cache_key(session)
+
+    with _token_lock:
+        now = time.time() # Wall clock rather than monotonic so expiry times stay valid across processes
+
+        if key not in _token_cache:
+            _token_cache.update(_read_token_cache())
+
+        cached = _token_cache.get(key)
+        if cached and now < cached[1] - TOKEN_EXPIRY_BUFFER:
+            return cached[0]
+
+        auth_response = request_jwt(session)
+        auth_response.raise_for_status()
+        response_json = auth_response.json()
+
+        token = response_json.get('access_token')
+        if not token:
+            raise ValueError('Auth response did not contain an access_token.') # Never cache a missing token for the whole TTL
+
+        expires_at = now + int(response_json.get('expires_in') or TOKEN_DEFAULT_TTL)
+
+        _token_cache[key] = (token, expires_at)
+
+        # Drop expired tokens, e.g. ones keyed on AWS credentials that have since rotated
+        for expired_key in [cache_key for cache_key, (_, cache_expires_at) in _token_cache.items() if cache_expires_at <= now]:
+            del _token_cache[expired_key]
+
+        _write_token_cache(_token_cache)
+
+    return token
+
+def _schedule_token_refresh(session):
+    """
+    Start a daemon timer that refreshes the token `TOKEN_EXPIRY_BUFFER` seconds before it expires, so user requests never wait on the auth endpoint.
+    """
+    try:
+        expires_at = _token_cache.get(_token_cache_key(session), (None, 0))[1] # Missing if the AWS credentials rotated and the refresh failed
+        delay = max(expires_at - TOKEN_EXPIRY_BUFFER - time.time(), TOKEN_RETRY_DELAY)
+    except Exception:
+        logger.warning('Could not determine the token expiry, retrying the refresh in %s seconds.', TOKEN_RETRY_DELAY, exc_info=True)
+        delay = TOKEN_RETRY_DELAY # Keep the refresh loop alive even if the AWS credentials can't be resolved right now
+
+    timer = threading.Timer(delay, _refresh_token, args=(session,))
+    timer.daemon = True
+    timer.start()
+
+def _refresh_token(session):
+    try:
+        get_token(session)
+    except Exception:
+        logger.warning('Background OAuth token refresh failed, get_connection will refresh inline if needed.', exc_info=True)
+    finally:
+        _schedule_token_refresh(session)
+
+token = get_token(_boto_session)
+_schedule_token_refresh(_boto_session)
 
 sf_options = {
     'url': SF_URL,
@@ -69,7 +179,39 @@ sf_options = {
     'schema': SF_SCHEMA,
     'warehouse': SF_WAREHOUSE,
     'authenticator': 'oauth',
-    'token': token
+    'token': token,
+    'client_session_keep_alive': True, # Heartbeat keeps idle sessions from expiring and forcing a re-auth
+    'client_session_keep_alive_heartbeat_frequency': 900
 }
 
-sf_conn = snowflake.connector.connect(**sf_options)
+def _connect():
+    return snowflake.connector.connect(**{**sf_options, 'token': get_token(_boto_session)})
+
+_connection_slots = threading.BoundedSemaphore(SF_POOL_SIZE)
+_connection_pool = queue.LifoQueue(maxsize=SF_POOL_SIZE)
+_connection_pool.put(_connect())
+
+@contextmanager
+def get_connection():
+    """
+    Check out a Snowflake connection from the pool and return it once the block exits.
+
+    At most `SF_POOL_SIZE` connections are open at a time. Closed connections are replaced with a new one using a fresh OAuth token.
+    The OAuth token is only used to open a session, so queries on an open connection are unaffected by token rotation.
+
+    Yields:
+    snowflake.connector.SnowflakeConnection: An open Snowflake connection.
+    """
+    with _connection_slots:
+        try:
+            conn = _connection_pool.get_nowait()
+        except queue.Empty:
+            conn = None
+
+        if conn is None or conn.is_closed():
+            conn = _connect()
+
+        try:
+            yield conn
+        finally:
+            _connection_pool.put_nowait(conn)
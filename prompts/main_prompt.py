@@ -1,7 +1,12 @@
-import os, json
+import os, json, importlib, logging
 import streamlit as st
-from datetime import date
-from config_oidc import sf_conn
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from config_oidc import get_connection
+from utils import get_table_context_json
+
+logger = logging.getLogger(__name__)
 
 # General prompt for AI to set up the behavior
 behavioral_prompt = """
@@ -113,35 +118,87 @@ use_cases = {
     },
 }
 
-# Create full prompt joining general instructions with table context and time variables
-@st.cache_data(show_spinner='Waking AI up...')
-def generate_prompt(use_case_name): 
+# List of available use cases
+USE_CASE_NAMES = tuple(use_cases.keys())
+
+# Fetch the available time frame of every use case in a single query. Cached on disk so new sessions and restarts skip the warehouse round-trip
+@st.cache_data(persist='disk', show_spinner=False)
+def fetch_date_ranges():
+    date_range_query = " UNION ALL ".join(
+        f"SELECT %s AS USE_CASE, MIN(DS) AS MIN_DATE, MAX(DS) AS MAX_DATE FROM {use_case['main_datasource']}"
+        for use_case in use_cases.values()
+    )
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            dates = cursor.execute(date_range_query, list(use_cases.keys())).fetchall() # A handful of tiny rows, no need for a DataFrame
+        finally:
+            cursor.close()
+
+    return {use_case_name: (min_date, max_date) for use_case_name, min_date, max_date in dates}, today_utc()
+
+# Return the date ranges as of the UTC day `ds`. The single disk entry is replaced once it's from an earlier day, instead of keeping one file per day
+def get_date_ranges(ds):
+    date_ranges, fetched_on = fetch_date_ranges()
+
+    if fetched_on != ds:
+        fetch_date_ranges.clear()
+        date_ranges, _ = fetch_date_ranges()
+
+    return date_ranges
 
-    cursor = sf_conn.cursor()
+def today_utc():
+    return datetime.now(timezone.utc).date() # DS is daily, so the date ranges only change once a day
+
+# Combine the table details of a use case prompt file into its table context. Errors are returned instead of raised so one broken use case doesn't take down the others
+def load_table_context(use_case):
+    try:
+        prompt_file = importlib.import_module(use_case["prompt_file"])
+        return get_table_context_json(
+            prompt_file.source_tables,
+            prompt_file.descriptions,
+            getattr(prompt_file, "groupings", {}),
+            prompt_file.relationships,
+            prompt_file.examples)
+    except Exception as e:
+        logger.exception(f"Failed to load the table context from {use_case['prompt_file']}.")
+        return e
+
+# Load the table context of every use case once at startup. Metadata queries run in parallel, one thread per use case
+with ThreadPoolExecutor(max_workers=len(use_cases), initializer=add_script_run_ctx, initargs=(None, get_script_run_ctx())) as executor:
+    for use_case, table_context in zip(use_cases.values(), executor.map(load_table_context, use_cases.values())):
+        use_case["table_context"] = table_context
+
+# Warm up the date ranges once at startup so switching use cases doesn't query Snowflake. On failure generate_prompt retries and reports the error
+try:
+    get_date_ranges(today_utc())
+except Exception:
+    logger.exception("Failed to fetch the use case date ranges at startup.")
+
+# Create full prompt joining general instructions with table context and time variables. The day is part of the cache key so the prompt's dates move on daily
+@st.cache_data(show_spinner='Waking AI up...')
+def generate_prompt(use_case_name, ds): 
 
     try:
         use_case = use_cases.get(use_case_name)
         if not use_case:
             raise ValueError(f"No configuration found for use case: {use_case_name}")
 
-        main_datasource = use_case["main_datasource"]
-        dates = cursor.execute(f"SELECT MIN(DS), MAX(DS) FROM {main_datasource}").fetch_pandas_all()
+        dates = get_date_ranges(ds).get(use_case_name)
 
-        prompt_file_path = use_case["prompt_file"]
-        prompt_file = __import__(prompt_file_path, fromlist=["table_context"])
-        table_context = prompt_file.table_context
+        table_context = use_case["table_context"]
+        if isinstance(table_context, Exception): # Loading failed at startup
+            raise table_context
 
     except Exception as e:
         st.error(f"An error occurred: {e}")
         return None
-    finally:
-        cursor.close()
 
-    if dates.empty:
+    if dates is None or dates[0] is None:
         st.warning("No data found for the selected use case.")
         return None
 
-    min_date = dates.iloc[0, 0]
-    max_date = dates.iloc[0, 1]
+    min_date, max_date = dates
 
-    return behavioral_prompt.format(context=table_context, today=date.today(), min_date=min_date, max_date=max_date)
+    return behavioral_prompt.format(context=table_context, today=ds, min_date=min_date, max_date=max_date)
@@ -1,5 +1,3 @@
-from utils import get_table_context_json
-
 source_tables = [
     {
         'database': 'DATABASE', 
@@ -69,6 +67,3 @@ examples = [
         """
     },###...
 ]
-
-# Combine the general prompt and table details to generate the system prompt 
-table_context = get_table_context_json(source_tables, descriptions, relationships, examples)
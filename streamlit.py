@@ -1,8 +1,6 @@
 import streamlit as st
-from openai import OpenAI
-from streamlit_feedback import streamlit_feedback
 from streamlit.runtime.scriptrunner_utils.script_run_context import get_script_run_ctx
-import re, time, pytz, os, random
+import time, os, random
 import pandas as pd
 from datetime import date, datetime
 
@@ -10,18 +8,13 @@ st.set_page_config(page_title='AI SQL Chatbot',
                    initial_sidebar_state='expanded',
                    page_icon='logos/logo.png')
 
-from prompts.main import use_cases, generate_prompt
-from utils import spinner_messages, generate_question_id, execute_sql, plot_dataframe, report_bug, write_data_to_sf, update_feedback
+from prompts.main import USE_CASE_NAMES, generate_prompt, today_utc
+from utils import spinner_messages, MAX_RESULT_ROWS, SCORE_MAPPINGS, LOG_TIMEZONE, SQL_BLOCK_PATTERN, generate_question_id, execute_sql, plot_dataframe, report_bug, log_chat_history, update_feedback
 
 # Inject CSS
 with open('styles.css') as style:
     st.html(f'<style>{style.read()}</style>')
 
-# OpenAI credentials
-client = OpenAI(
-    organization = os.environ.get('OPENAI_ORGANIZATION'),
-    api_key = os.environ.get('OPENAI_API_KEY'))
-
 # Initialize session state
 for key in ['session_id', 'use_case', 'feedback']:
     if key not in st.session_state:
@@ -31,24 +24,59 @@ for key in ['messages', 'chat_history']:
     if key not in st.session_state:
         st.session_state[key] = []
 
+if 'prompt_cache' not in st.session_state:
+    st.session_state.prompt_cache = {}
+
+# Reuse the formatted system prompt within the session, it only changes with the use case and the date
+def get_system_prompt(use_case):
+    ds = today_utc() # Same day value as the date ranges in generate_prompt
+    prompt_key = (use_case, ds)
+
+    if prompt_key not in st.session_state.prompt_cache:
+        system_prompt = generate_prompt(use_case, ds)
+        if system_prompt is None: # Don't cache failures so the next attempt retries
+            return None
+        st.session_state.prompt_cache[prompt_key] = system_prompt
+
+    return st.session_state.prompt_cache[prompt_key]
+
 # Functions to control immediate effect on session state
 def select_question():
     st.session_state.selected_question = True
 
 def set_initial_use_case():
     st.session_state.use_case = st.session_state.initial_use_case
-    st.session_state.messages = [{'role': 'developer', 'content': generate_prompt(st.session_state.use_case)}]
+    st.session_state.messages = [{'role': 'developer', 'content': get_system_prompt(st.session_state.use_case)}]
 
 def change_use_case():
     st.session_state.use_case = st.session_state.sidebar_use_case
-    st.session_state.messages = [{'role': 'developer', 'content': generate_prompt(st.session_state.use_case)}]
+    st.session_state.messages = [{'role': 'developer', 'content': get_system_prompt(st.session_state.use_case)}]
 
 def clear_chat():
     st.session_state.chat_history = []
-    st.session_state.messages = [{'role': 'developer', 'content': generate_prompt(st.session_state.use_case)}]
+    st.session_state.messages = [{'role': 'developer', 'content': get_system_prompt(st.session_state.use_case)}]
 
-# List of available use cases
-use_case_names = [use_case[0] for use_case in use_cases.items()]
+# Display existing chat messages
+def render_chat_history():
+    for message in st.session_state.messages:
+        if message['role'] == 'developer': # Hide the system prompt from chat UI
+            continue
+
+        if message['role'] == 'assistant':
+            with st.chat_message(message['role'], avatar='logos/trippy_logo.png'):
+                st.markdown(message['content'])
+                
+                # Check if message contains a dataframe or if SQL returned an error
+                if isinstance(message.get('sql_result'), pd.DataFrame):
+                    st.dataframe(message['sql_result'], hide_index=True)
+                    if message['sql_result'].attrs.get('truncated'):
+                        st.caption(f'Showing the first {MAX_RESULT_ROWS:,} rows')
+                elif message.get('sql_error') is not None:
+                    st.error(message['sql_error'])
+
+        else:
+            with st.chat_message(message['role']):
+                st.markdown(message['content'])
 
 # Generate session ID 
 ctx = get_script_run_ctx()
@@ -64,8 +92,8 @@ with st.sidebar:
             "Active use case",
             label_visibility="collapsed",
             key="sidebar_use_case",
-            options=use_case_names,
-            index=use_case_names.index(st.session_state.use_case),
+            options=USE_CASE_NAMES,
+            index=USE_CASE_NAMES.index(st.session_state.use_case),
             help="Your session will restart once you switch the active use case.",
             on_change=change_use_case,
         )
@@ -92,7 +120,7 @@ if st.session_state.use_case is None:
         'Your use case', 
         label_visibility='collapsed',
         key='initial_use_case', 
-        options=use_case_names, 
+        options=USE_CASE_NAMES, 
         index=None,
         placeholder='Choose your use case to wake chatbot up.',
         on_change=set_initial_use_case)
@@ -100,24 +128,17 @@ if st.session_state.use_case is None:
 # Enable chat input only after any use case is selected
 else:
 
-    # Display existing chat messages
-    for message in st.session_state.messages:
-        if message['role'] == 'developer': # Hide the system prompt from chat UI
-            continue
+    # Chat-only dependencies are imported here so the landing page doesn't wait for them
+    from openai import OpenAI
+    from streamlit_feedback import streamlit_feedback
 
-        if message['role'] == 'assistant':
-            with st.chat_message(message['role'], avatar='logos/trippy_logo.png'):
-                st.markdown(message['content'])
-                
-                # Check if message contains a dataframe or if SQL returned an error
-                if isinstance(message.get('sql_result'), pd.DataFrame):
-                    st.dataframe(message['sql_result'], hide_index=True)
-                elif message.get('error') is not None:
-                    st.error(message['error'])
+    # OpenAI credentials
+    client = OpenAI(
+        organization = os.environ.get('OPENAI_ORGANIZATION'),
+        api_key = os.environ.get('OPENAI_API_KEY'))
 
-        else:
-            with st.chat_message(message['role']):
-                st.markdown(message['content'])
+    # Display existing chat messages
+    render_chat_history()
 
     # Initialize prompt variable
     prompt = None
@@ -143,7 +164,8 @@ else:
         with st.chat_message('assistant', avatar='logos/logo.png'):
             
             message_placeholder = st.empty()
-            response = ''
+            response_parts = []
+            last_render_time = time.monotonic()
 
             stream = client.chat.completions.create(
                 model='chatgpt-4o-latest', 
@@ -159,19 +181,23 @@ else:
 
             for chunk in stream:
                 if chunk.choices:
-                    response += chunk.choices[0].delta.content or ''
-                    message_placeholder.markdown(response + '▕') # Stream chunks with typewriter effect
+                    response_parts.append(chunk.choices[0].delta.content or '')
+
+                    if time.monotonic() - last_render_time >= 0.05: # Throttle re-renders to keep the typewriter effect without redrawing on every token
+                        message_placeholder.markdown(''.join(response_parts) + '▕')
+                        last_render_time = time.monotonic()
                 
                 if chunk.usage:
                     completion_tokens = chunk.usage.completion_tokens
                     prompt_tokens = chunk.usage.prompt_tokens
 
+            response = ''.join(response_parts)
             message_placeholder.markdown(response) # Show full response
 
             ai_response_time = round(time.time() - ai_start_time, 2) # Time to generate the AI response
 
             # Parse the response for a SQL query and execute
-            sql_match = re.search(r'`sql\n(.*)\n`', response, re.DOTALL)
+            sql_match = SQL_BLOCK_PATTERN.search(response)
 
             if sql_match:
 
@@ -184,6 +210,8 @@ else:
                 
                 if isinstance(result, pd.DataFrame):
                     st.dataframe(result, hide_index=True)
+                    if result.attrs.get('truncated'):
+                        st.caption(f'Showing the first {MAX_RESULT_ROWS:,} rows')
                     query_result = result
                     error_message = None
                 else: 
@@ -215,12 +243,12 @@ else:
             chat_history_entry = {
                 'QUESTION_ID': st.session_state.messages[-1]['question_id'],
                 'DS': date.today(),
-                'TIMESTAMP': datetime.now(pytz.timezone('Europe/Lisbon')).strftime('%Y-%m-%d %H:%M:%S'),
+                'TIMESTAMP': datetime.now(LOG_TIMEZONE).strftime('%Y-%m-%d %H:%M:%S'),
                 'SESSION_ID': st.session_state.session_id,
                 'QUESTION': prompt,
                 'FULL_ANSWER': st.session_state.messages[-1]['content'],
                 'SQL_QUERY': st.session_state.messages[-1]['query'],
-                'QUERY_RESULT': st.session_state.messages[-1]['sql_result'].to_json(orient='records') if st.session_state.messages[-1]['sql_result'] is not None else None,
+                'QUERY_RESULT': st.session_state.messages[-1]['sql_result'], # Serialized to JSON by the background log writer
                 'SQL_ERROR': st.session_state.messages[-1]['sql_error'],
                 'PROMPT_TOKENS': st.session_state.messages[-1]['prompt_tokens'],
                 'COMPLETION_TOKENS': st.session_state.messages[-1]['completion_tokens'],
@@ -231,13 +259,10 @@ else:
                 'USE_CASE': st.session_state.messages[-1]['use_case']}
 
             st.session_state.chat_history.append(chat_history_entry)
-            write_data_to_sf(pd.DataFrame([chat_history_entry]), 'CHAT_HISTORY') # Write chat logs back to Snowflake 
-
-    # Define scores for feedback widget
-    score_mappings = {'😞':0, '🙁':0.25, '😐':0.5, '🙂':0.75, '😀':1}
+            log_chat_history(chat_history_entry) # Write chat logs back to Snowflake in the background
 
     # Update chat history logs if user provides feedback
     if st.session_state.feedback:
-        st.session_state.chat_history[-1]['FEEDBACK_SCORE'] = score_mappings[st.session_state.feedback['score']]
+        st.session_state.chat_history[-1]['FEEDBACK_SCORE'] = SCORE_MAPPINGS[st.session_state.feedback['score']]
         st.session_state.chat_history[-1]['FEEDBACK_TEXT'] = st.session_state.feedback['text']
         update_feedback(st.session_state.chat_history[-1]['FEEDBACK_SCORE'], st.session_state.chat_history[-1]['FEEDBACK_TEXT'], st.session_state.chat_history[-1]['QUESTION_ID'])
@@ -1,10 +1,13 @@
-import string, secrets, time, re, json, os
+import secrets, time, re, json, atexit, threading, logging
 import streamlit as st
 import pandas as pd
-from datetime import datetime, date
-from snowflake.connector import connection
-from snowflake.connector.pandas_tools import write_pandas
-from config_oidc import sf_conn
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from config_oidc import get_connection
+
+logger = logging.getLogger(__name__)
 
 # Fun spinner messages
 spinner_messages = [
@@ -16,11 +19,49 @@ spinner_messages = [
     "Data elves are working hard, please wait..."
 ]
 
-# Get metadata from Snowflake and merge with the descriptions above
-@st.cache_data(hash_funcs={connection.SnowflakeConnection: lambda _: None}, show_spinner='Waking AI up...')
-def get_table_context_json(table_dict, descriptions, groupings, relationships, examples):
+# Define scores for feedback widget
+SCORE_MAPPINGS = {'😞':0, '🙁':0.25, '😐':0.5, '🙂':0.75, '😀':1}
+
+# Timezone of the chat log timestamps
+LOG_TIMEZONE = ZoneInfo('Europe/Lisbon')
+
+# Chat logs are buffered and written in batches in the background so Snowflake latency doesn't delay the answer
+LOG_BATCH_SIZE = 10 # Flush the buffer once this many entries are waiting...
+LOG_FLUSH_INTERVAL = 60 # ...or this many seconds after the first entry was buffered
+LOG_RESULT_MAX_ROWS = 1000 # Larger query results are truncated in the chat logs
+WRITE_PANDAS_MIN_ROWS = 10 # Smaller frames are inserted directly instead of staging a Parquet file...
+INSERT_MAX_CHARS = 500_000 # ...unless their values add up to more than this, as they are inlined into the INSERT statement
+
+log_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chat_log')
+log_lock = threading.Lock()
+log_buffer = {} # Question ID -> chat history entry waiting to be written
+pending_logs = {} # Question ID -> write in progress
+log_flush_timer = None
+
+# Matches the SQL block the prompt asks the model to wrap in ```sql ... ``` fences. Compiled here since streamlit.py is re-executed on every rerun
+SQL_BLOCK_PATTERN = re.compile(r'```sql\n(.*?)\n```', re.DOTALL)
+
+# Statements that could change our data
+DML_KEYWORDS = ('INSERT', 'UPDATE', 'DELETE', 'DROP', 'CREATE', 'ALTER', 'TRUNCATE')
+DML_PATTERN = re.compile(r'\b(INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|TRUNCATE)\b', re.IGNORECASE)
+
+# Query results are capped at this many rows, more can't be displayed or charted usefully anyway
+MAX_RESULT_ROWS = 100_000
+
+# Charts with more points than this are downsampled before being sent to the browser
+MAX_CHART_POINTS = 5000
+
+# Only company email addresses can report bugs
+EMAIL_PATTERN = re.compile(r'^[\w\.-]+@COMPANY_NAME\.\w+$')
+
+# Table metadata changes rarely, so it is cached on disk and refreshed once per window
+METADATA_CACHE_SECONDS = 3600
+
+# Get metadata from Snowflake and merge with the descriptions above. Cached on disk so restarts skip the metadata queries, one entry per use case
+@st.cache_data(persist='disk', show_spinner='Waking AI up...')
+def fetch_table_context_json(table_dict, descriptions, groupings, relationships, examples):
     """
-    Fetch metadata for tables from Snowflake and return it as a JSON object.
+    Fetch metadata for tables from Snowflake and return it as a JSON object, along with the time it was fetched.
     The JSON includes table descriptions, column metadata, default column groupings, joins, and examples.
 
     Args:
@@ -40,45 +81,62 @@ def get_table_context_json(table_dict, descriptions, groupings, relationships, e
         examples (list of dict): A list of example queries or usage examples to include in the JSON output.
 
     Returns:
-        str: A formatted JSON string containing the table metadata.
+        tuple: A compact JSON string containing the table metadata, and the epoch time it was fetched at.
     """
 
-    table_json = {'tables': [], 'examples':[]}
+    table_json = {'tables': [], 'examples': list(examples)}
+
+    # INFORMATION_SCHEMA is per database, so fetch the columns of all tables of a database in one query
+    tables_by_database = defaultdict(list)
+    for table_info in table_dict:
+        tables_by_database[table_info['database']].append(table_info)
+
+    table_columns = {}
 
-    for example in examples:
-        table_json['examples'].append(example)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            for database, database_tables in tables_by_database.items():
+                table_filters = []
+                params = [f'{database}.INFORMATION_SCHEMA.COLUMNS']
+
+                for table_info in database_tables:
+                    # Same filter for every table, the column list is bound as a JSON array (NULL fetches all columns)
+                    table_filters.append('(TABLE_SCHEMA = %s AND TABLE_NAME = %s AND (%s IS NULL OR ARRAY_CONTAINS(COLUMN_NAME::VARIANT, PARSE_JSON(%s))))')
+
+                    required_columns = table_info.get('columns') ## Only fetch columns that we define as necessary to decrease prompt token usage
+                    required_columns_json = json.dumps(required_columns) if required_columns else None
+                    params += [table_info['schema'], table_info['table'], required_columns_json, required_columns_json]
+
+                # Fetch columns DDL from Snowflake
+                columns = cursor.execute(f"""
+                SELECT TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, DATA_TYPE, COMMENT
+                FROM IDENTIFIER(%s)
+                WHERE {' OR '.join(table_filters)}
+                ORDER BY TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION
+                """, params).fetch_pandas_all()
+
+                for (schema, table), table_columns_df in columns.groupby(['TABLE_SCHEMA', 'TABLE_NAME'], sort=False):
+                    table_columns[(database, schema, table)] = table_columns_df
+        finally:
+            cursor.close()
 
     for table_info in table_dict:
         table = table_info['table']
         schema = table_info['schema']
         database = table_info['database']
-        required_columns = table_info.get('columns') ## Only fetch columns that we define as necessary to decrease prompt token usage
 
-        if required_columns:
-            column_filter = 'AND COLUMN_NAME IN ({})'.format(', '.join([f"'{col}'" for col in required_columns]))
-        else:
-            column_filter = ''
-
-        # Fetch columns DDL from Snowflake
-        cursor = sf_conn.cursor()
-
-        columns = cursor.execute(f"""
-        SELECT COLUMN_NAME, DATA_TYPE, COMMENT
-        FROM {database}.INFORMATION_SCHEMA.COLUMNS
-        WHERE TABLE_SCHEMA = '{schema}' AND TABLE_NAME = '{table}'
-        {column_filter}
-        """).fetch_pandas_all()
+        columns_list = []
+        table_groupings = groupings.get(table, {})
+        table_relationships = relationships.get(table, {})
 
-        cursor.close()
+        columns = table_columns.get((database, schema, table), pd.DataFrame(columns=['COLUMN_NAME', 'DATA_TYPE', 'COMMENT']))
 
-        columns_list = []
-        
-        for i in range(len(columns['COLUMN_NAME'])):
-            column_name = columns['COLUMN_NAME'][i]
-            column_data_type = columns['DATA_TYPE'][i]
-            column_description = columns['COMMENT'][i] if columns['COMMENT'][i] else 'No description available'
-            column_grouping_info = groupings.get(table, {}).get(column_name, {})
-            column_joins = relationships.get(table, {}).get(column_name, {})
+        for column_name, column_data_type, column_comment in columns[['COLUMN_NAME', 'DATA_TYPE', 'COMMENT']].itertuples(index=False, name=None):
+            column_description = 'No description available' if pd.isna(column_comment) or column_comment == '' else column_comment
+            column_grouping_info = table_groupings.get(column_name, {})
+            column_joins = table_relationships.get(column_name, {})
             
             columns_list.append({
                 'column_name': column_name,
@@ -97,22 +155,39 @@ def get_table_context_json(table_dict, descriptions, groupings, relationships, e
             'columns': columns_list,
         })
 
-    return json.dumps(table_json, indent=4)
+    return json.dumps(table_json, separators=(',', ':')), time.time() # Compact, since the JSON goes into the prompt and whitespace costs tokens
+
+def get_table_context_json(table_dict, descriptions, groupings, relationships, examples):
+    """
+    Return the table context JSON of a use case, refetching it once the cached copy is older than `METADATA_CACHE_SECONDS`.
+    Streamlit ignores `ttl` for disk-persisted caches, so the stale entry is replaced in place rather than keyed by time, which would leave a file behind every window.
+
+    Args:
+        See `fetch_table_context_json`.
+
+    Returns:
+        str: A compact JSON string containing the table metadata.
+    """
+    table_context_json, fetched_at = fetch_table_context_json(table_dict, descriptions, groupings, relationships, examples)
+
+    if time.time() - fetched_at >= METADATA_CACHE_SECONDS:
+        fetch_table_context_json.clear(table_dict, descriptions, groupings, relationships, examples)
+        table_context_json, _ = fetch_table_context_json(table_dict, descriptions, groupings, relationships, examples)
+
+    return table_context_json
 
 def generate_question_id(length=16):
     """
-    Generate a random alphanumeric identifier for each question.
+    Generate a random URL-safe identifier for each question.
 
     Args:
         length (int, optional): The length of the identifier. Default is 16.
 
     Returns:
-        str: A randomly generated alphanumeric string of the specified length.
+        str: A randomly generated string of letters, digits, '-' and '_' of the specified length.
     """
 
-    alphabet = string.ascii_letters + string.digits
-    key = ''.join(secrets.choice(alphabet) for _ in range(length))
-    return key     
+    return secrets.token_urlsafe(length)[:length] # token_urlsafe returns ~1.3 characters per byte, so slicing always leaves `length` characters
 
 def execute_sql(sql):
     """
@@ -122,40 +197,65 @@ def execute_sql(sql):
         sql_match (re.Match): A regular expression match object containing the SQL query in the first capturing group.
 
     Returns:
-        pd.DataFrame: A DataFrame containing the results of the executed SQL query if successful.
+        pd.DataFrame: A DataFrame containing the results of the executed SQL query if successful, capped at `MAX_RESULT_ROWS` rows. `attrs['truncated']` is True if rows were cut off.
         str: An error message if the query execution fails or if the query contains potentially dangerous DML statements.
     """
 
     # Check for DML statements
-    if re.search(r'\b(INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|TRUNCATE)\b', sql, re.IGNORECASE):
+    # Cheap substring scan first, the regex only confirms word boundaries (e.g. ignores CREATED_AT) when a keyword shows up
+    sql_upper = sql.upper()
+    if any(keyword in sql_upper for keyword in DML_KEYWORDS) and DML_PATTERN.search(sql):
         return 'Nice try, but dangerous changes to our data is not allowed here! Try asking question about our data instead.'
 
-    cursor = sf_conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    try:
-        result = cursor.execute(sql).fetch_pandas_all()
-        return result.dropna(how='all')
-    
-    except Exception as e:
-        error_message = str(e)
-        match = re.search(r'SQL compilation error:', error_message)
+        try:
+            # Read the result batch by batch so we never hold more than MAX_RESULT_ROWS rows in memory
+            result_batches = []
+            row_count = 0
+
+            for batch in cursor.execute(sql).fetch_pandas_batches():
+                result_batches.append(batch)
+                row_count += len(batch)
+                if row_count > MAX_RESULT_ROWS: # Read past the cap so we know whether rows were cut off
+                    break
+
+            if not result_batches:
+                return pd.DataFrame(columns=[column.name for column in cursor.description])
+
+            result = pd.concat(result_batches, ignore_index=True, copy=False).head(MAX_RESULT_ROWS)
+            result = result.loc[result.notna().to_numpy().any(axis=1)] # Drop rows where every value is null
+            result.attrs['truncated'] = row_count > MAX_RESULT_ROWS
+            return result
+        
+        except Exception as e:
+            error_message = str(e)
+            _, separator, compilation_error = error_message.partition('SQL compilation error:')
 
-        if match:
-            return error_message.split('SQL compilation error:', 1)[1]
-        else:
-            return error_message
-    finally:
-        cursor.close()
+            if separator:
+                return compilation_error
+            else:
+                return error_message
+        finally:
+            cursor.close()
+
+# Prepare a dataframe for plotting. Cached so interacting with the chart widgets doesn't redo the renaming and dtype inference.
+# Bounded since every query result up to MAX_RESULT_ROWS gets its own entry, and only the charts on screen need to stay cached
+@st.cache_data(max_entries=20, ttl=3600, show_spinner=False)
+def prep_plot_df(df):
+    """
+    Rename columns for readability and detect the columns usable as X and Y axes.
 
-def plot_dataframe(question_id, df):
-    """Plot numeric columns from the dataframe with an intelligent chart type selector and customizable axes."""
-    
-    if df.empty:
-        st.warning("No data available for plotting.")
-        return
+    Args:
+        df (pd.DataFrame): The query result to plot.
+
+    Returns:
+        tuple: The renamed DataFrame, the X-axis options (list of str), the Y-axis options (list of str) and whether the default X-axis is a time series (bool).
+    """
 
     # Rename columns for readability
-    df = df.rename(columns={col: col.replace("_", " ").title() for col in df.columns})
+    df = df.set_axis(df.columns.str.replace('_', ' ', regex=False).str.title(), axis=1)
 
     # Detect possible X-axis columns (preferably time series or categorical)
     x_options = df.select_dtypes(include=['datetime64[ns]', 'object']).columns.tolist()
@@ -170,15 +270,36 @@ def plot_dataframe(question_id, df):
     if pd.api.types.is_datetime64_any_dtype(df[default_x]):
         is_time_series = True
     else:
-        try:
-            df[default_x] = pd.to_datetime(df[default_x])
-            is_time_series = True
-        except Exception:
-            pass
+        # Try the first value before converting the whole column, so non-date columns fail fast
+        first_valid_index = df[default_x].first_valid_index()
+        if first_valid_index is not None and not pd.isna(pd.to_datetime(df[default_x].loc[first_valid_index], errors='coerce')):
+            for datetime_format in ('ISO8601', 'mixed'): # ISO8601 is parsed on the fast path, mixed falls back to per-value inference
+                try:
+                    df[default_x] = pd.to_datetime(df[default_x], format=datetime_format)
+                    is_time_series = True
+                    break
+                except (ValueError, TypeError):
+                    continue
 
     # Detect possible Y-axis columns (numeric only)
     y_options = df.select_dtypes(include=['number']).columns.tolist()
 
+    return df, x_options, y_options, is_time_series
+
+def plot_dataframe(question_id, df):
+    """Plot numeric columns from the dataframe with an intelligent chart type selector and customizable axes."""
+    
+    if df.empty:
+        st.warning("No data available for plotting.")
+        return
+
+    render_chart(question_id, df)
+
+# Runs as a fragment so changing the chart widgets only reruns the chart, not the query and the AI answer above it
+@st.fragment
+def render_chart(question_id, df):
+    df, x_options, y_options, is_time_series = prep_plot_df(df) # Cached, so fragment reruns skip the preparation
+
     if not y_options:
         st.error("No numeric columns available for plotting.")
         return
@@ -191,10 +312,17 @@ def plot_dataframe(question_id, df):
 
         # Let users choose X and Y axes
         axis_row = st.columns([1,1])
-        x_axis = axis_row[0].selectbox("Select X-axis", x_options, index=df.columns.get_loc(default_x))
-        y_axis = axis_row[1].selectbox("Select Y-axis", y_options, index=0)
+        x_axis = axis_row[0].selectbox("Select X-axis", x_options, index=0, key=f'x_axis_{question_id}')
+        y_axis = axis_row[1].selectbox("Select Y-axis", y_options, index=0, key=f'y_axis_{question_id}')
         #y_axis = axis_row[1].multiselect("Select Y-axis", y_options, default=[y_options[0]])
 
+    # Downsample large results, every point is serialized to the browser and more can't be told apart anyway
+    if len(df) > MAX_CHART_POINTS:
+        if chart_choice == "📈 Line chart":
+            df = df.iloc[::len(df) // MAX_CHART_POINTS + 1]
+        elif x_axis != y_axis: # Grouping a column by itself would fail, nothing to aggregate then
+            df = df.groupby(x_axis, as_index=False, dropna=False)[y_axis].sum() # Keep the NULL category, the full chart shows it too
+
     # Plot the selected chart
     st.write(f'**{y_axis} by {x_axis}**')
 
@@ -206,6 +334,7 @@ def plot_dataframe(question_id, df):
 def write_data_to_sf(df, database_name, schema_name, table_name):
     """
     Writes a DataFrame to a specified table in the Snowflake.
+    Frames smaller than `WRITE_PANDAS_MIN_ROWS` rows and `INSERT_MAX_CHARS` characters are written with a single INSERT. Larger ones, or small ones whose INSERT fails, are staged as Parquet and loaded with `write_pandas`.
 
     Args:
         df (pd.DataFrame): The DataFrame to be written. The DataFrame should have columns matching the structure of the target table in Snowflake.
@@ -214,43 +343,203 @@ def write_data_to_sf(df, database_name, schema_name, table_name):
     Returns:
         None
     """
+    df = df.set_axis(df.columns.str.upper(), axis=1) # Match Snowflake's unquoted identifiers
+
     try:
-        write_pandas(sf_conn, df, database=database_name, schema=schema_name, table_name=table_name)
+        with get_connection() as conn:
+            if len(df) < WRITE_PANDAS_MIN_ROWS:
+                rows = list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+                # Bound values are inlined into the statement text, so large payloads (e.g. logged query results) go through write_pandas instead
+                if sum(len(str(value)) for row in rows for value in row) < INSERT_MAX_CHARS:
+                    insert_query = f"INSERT INTO {database_name}.{schema_name}.{table_name} ({', '.join(df.columns)}) VALUES ({', '.join(['%s'] * len(df.columns))})"
+
+                    cursor = conn.cursor()
+                    try:
+                        cursor.executemany(insert_query, rows)
+                        return 'Success'
+                    except Exception:
+                        logger.warning('Batch insert into %s.%s.%s failed, retrying with write_pandas.', database_name, schema_name, table_name, exc_info=True)
+                    finally:
+                        cursor.close()
+
+            from snowflake.connector.pandas_tools import write_pandas # Pulls in PyArrow, only import it once a write needs it
+
+            write_pandas(conn, df, database=database_name, schema=schema_name, table_name=table_name,
+                         quote_identifiers=False, auto_create_table=False, use_logical_type=True, chunk_size=16_000_000, parallel=4)
         return 'Success'
     except Exception as e:
         return e
 
+def write_chat_history(chat_history_entries):
+    """
+    Serialize the query results of chat history entries and write them to Snowflake in one batch.
+    Failures are logged, since nobody waits on the result of the background write.
 
-def update_feedback(feedback_score, feedback_text, question_id):
+    Args:
+        chat_history_entries (list of dict): The chat log rows. `QUERY_RESULT` may be a DataFrame, which is stored as JSON records capped at `LOG_RESULT_MAX_ROWS` rows.
+            Truncated results are stored as `{"truncated": true, "total_rows": ..., "records": [...]}` instead, where `total_rows` is the number of rows fetched.
+
+    Returns:
+        str or Exception: The result of `write_data_to_sf`.
     """
-    Update chat logs with provided user feedback.
+    for chat_history_entry in chat_history_entries:
+        query_result = chat_history_entry.get('QUERY_RESULT')
+        if isinstance(query_result, pd.DataFrame):
+            records = query_result.head(LOG_RESULT_MAX_ROWS).to_json(orient='records')
+
+            # Wrap truncated results so the logs don't pass them off as the full answer
+            if len(query_result) > LOG_RESULT_MAX_ROWS or query_result.attrs.get('truncated'):
+                records = f'{{"truncated":true,"total_rows":{len(query_result)},"records":{records}}}'
+
+            chat_history_entry['QUERY_RESULT'] = records
+
+    write_status = write_data_to_sf(pd.DataFrame(chat_history_entries), 'DATABASE', 'SCHEMA', 'CHAT_HISTORY')
+
+    if write_status != 'Success':
+        question_ids = ', '.join(str(chat_history_entry['QUESTION_ID']) for chat_history_entry in chat_history_entries)
+        logger.error('Failed to write chat history for questions %s.', question_ids, exc_info=write_status)
+
+    return write_status
+
+def flush_chat_history(background=True):
+    """
+    Write all buffered chat history entries to Snowflake as one batch.
 
     Args:
-        feedback_score (int or float): The score representing the user's feedback.  Should be a numeric value, typically a rating score (e.g., 1-5).
-        feedback_text (str): The text feedback provided by the user. This can be a string describing the user's experience or suggestions.
-        question_id (str): The unique identifier of the question being reviewed. This is used to match the specific record in the `CHAT_HISTORY` table.
+        background (bool, optional): Submit the write to the background log writer. If False, write in the calling thread. Default is True.
+
+    Returns:
+        concurrent.futures.Future or None: The pending write when running in the background, None otherwise.
+    """
+    global log_flush_timer
+
+    with log_lock:
+        if log_flush_timer is not None:
+            log_flush_timer.cancel()
+            log_flush_timer = None
+
+        chat_history_entries = list(log_buffer.values())
+        log_buffer.clear()
+
+        if not chat_history_entries:
+            return None
+
+        if not background:
+            write_chat_history(chat_history_entries)
+            return None
+
+        future = log_executor.submit(write_chat_history, chat_history_entries)
+        for chat_history_entry in chat_history_entries:
+            pending_logs[chat_history_entry['QUESTION_ID']] = future
+
+    def forget_pending_logs(_):
+        for chat_history_entry in chat_history_entries:
+            pending_logs.pop(chat_history_entry['QUESTION_ID'], None)
+
+    future.add_done_callback(forget_pending_logs)
+    return future
+
+# Write whatever is still buffered on shutdown. The executor no longer accepts work at that point, so write in place
+atexit.register(flush_chat_history, background=False)
+
+def log_chat_history(chat_history_entry):
+    """
+    Buffer a chat history entry to be written to Snowflake without blocking the script.
+    The buffer is flushed in the background once it holds `LOG_BATCH_SIZE` entries or `LOG_FLUSH_INTERVAL` seconds after the first entry arrived.
+
+    Args:
+        chat_history_entry (dict): The chat log row, keyed by `CHAT_HISTORY` column names. Must contain `QUESTION_ID`.
 
     Returns:
         None
     """
+    global log_flush_timer
+
+    with log_lock:
+        log_buffer[chat_history_entry['QUESTION_ID']] = dict(chat_history_entry) # Copy now, the session's entry is updated later with feedback
+        batch_full = len(log_buffer) >= LOG_BATCH_SIZE
+
+        if not batch_full and log_flush_timer is None:
+            log_flush_timer = threading.Timer(LOG_FLUSH_INTERVAL, flush_chat_history)
+            log_flush_timer.daemon = True
+            log_flush_timer.start()
+
+    if batch_full:
+        flush_chat_history()
+
+def write_feedback(feedback_score, feedback_text, question_id):
+    """
+    Submit the UPDATE that stores user feedback on an already written chat log.
+
+    Args:
+        feedback_score (int or float): The score representing the user's feedback.
+        feedback_text (str): The text feedback provided by the user.
+        question_id (str): The unique identifier of the question being reviewed.
 
+    Returns:
+        str: The Snowflake query ID of the asynchronous UPDATE.
+    """
     update_table_query = """
     UPDATE DATABASE.SCHEMA.TABLE 
     SET FEEDBACK_SCORE = %s, FEEDBACK_TEXT = %s
     WHERE QUESTION_ID = %s
     """
-    cursor = sf_conn.cursor()
 
-    try:
-        cursor.execute(update_table_query, (feedback_score, feedback_text, question_id))
-        feedback_container = st.empty()
-        feedback_container.success('Thank you for your feedback!')
-        time.sleep(2)
-        feedback_container.empty()
-    except Exception as e:
-        st.error(f'An error occurred while logging your feedback: {e}.')
-    finally:
-        cursor.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        try:
+            # Submit without waiting for the result, Snowflake keeps running the update after the cursor is closed
+            cursor.execute_async(update_table_query, (feedback_score, feedback_text, question_id))
+            return cursor.sfqid
+        finally:
+            cursor.close()
+
+def log_feedback_failure(future):
+    """
+    Log a failed background feedback update, since nobody waits on its result.
+    """
+    if future.exception() is not None:
+        logger.error('Failed to write feedback.', exc_info=future.exception())
+
+def update_feedback(feedback_score, feedback_text, question_id):
+    """
+    Update chat logs with provided user feedback.
+
+    Args:
+        feedback_score (int or float): The score representing the user's feedback.  Should be a numeric value, typically a rating score (e.g., 1-5).
+        feedback_text (str): The text feedback provided by the user. This can be a string describing the user's experience or suggestions.
+        question_id (str): The unique identifier of the question being reviewed. This is used to match the specific record in the `CHAT_HISTORY` table.
+
+    Returns:
+        str or None: The Snowflake query ID of the asynchronous UPDATE, which can be checked with `get_query_status`. None if the feedback was merged into a buffered chat log, queued behind a chat log that is still being written, or couldn't be submitted.
+    """
+
+    query_id = None
+
+    # Feedback on a chat log that hasn't been written yet is written together with it
+    with log_lock:
+        buffered_entry = log_buffer.get(question_id)
+        if buffered_entry is not None:
+            buffered_entry['FEEDBACK_SCORE'] = feedback_score
+            buffered_entry['FEEDBACK_TEXT'] = feedback_text
+
+    if buffered_entry is None:
+        pending_log = pending_logs.get(question_id)
+
+        if pending_log is not None:
+            # The log writer has a single worker, so the update runs only after the pending INSERT has finished
+            log_executor.submit(write_feedback, feedback_score, feedback_text, question_id).add_done_callback(log_feedback_failure)
+        else:
+            try:
+                query_id = write_feedback(feedback_score, feedback_text, question_id)
+            except Exception as e:
+                st.error(f'An error occurred while logging your feedback: {e}.')
+                return None
+
+    st.toast('Thank you for your feedback!', icon='✅')
+    return query_id
 
 # Popover dialog
 @st.dialog('🐞 Report a Bug')
@@ -273,7 +562,7 @@ def report_bug():
 
     if st.button('Submit', key='submit_bug', disabled=(reporter_email=='' or bug_description=='')):
 
-        if bug_description and reporter_email and re.match(r'^[\w\.-]+@COMPANY_NAME\.\w+$', reporter_email) is not None:
+        if bug_description and reporter_email and EMAIL_PATTERN.match(reporter_email) is not None:
 
             st.session_state.bug_report = {
                 'reporter_email': reporter_email,
@@ -290,16 +579,15 @@ def report_bug():
                         }])
 
             with st.spinner('Submitting your bug report...'):
-                bug_submission_status = write_data_to_sf(bug_df, 'BUG_REPORTS') 
+                bug_submission_status = write_data_to_sf(bug_df, 'DATABASE', 'SCHEMA', 'BUG_REPORTS')
 
             if bug_submission_status == 'Success':
-                st.success("Thank you for reporting the bug! We'll look into it.")
-                time.sleep(2)
+                st.toast("Thank you for reporting the bug! We'll look into it.", icon='✅')
                 st.rerun()
             else:
                 st.error(f'An error occurred while saving your bug: {bug_submission_status}. Please try again or reach out to [Melisa Kocbas](https://slack.com/app_redirect?channel=U03J7NV0XQF) if the issue persists.')
         
-        elif re.match(r'^[\w\.-]+@tripadvisor\.\w+$', reporter_email) is None:
+        elif EMAIL_PATTERN.match(reporter_email) is None:
             st.error('Please enter a valid email address.')
         
         else: